@@ -1,10 +1,12 @@
-import os, datetime, re
+import os, datetime, re, hashlib, hmac
 from functools import wraps
 import mysql.connector as connector
 from flask import Flask, render_template, session, request, redirect, url_for, flash, abort, send_file, send_from_directory, jsonify
 from flask_login import LoginManager, UserMixin, login_user, logout_user, current_user, login_required
 from werkzeug.utils import secure_filename
 from mysqldb import DBConnector
+from throttle import AuthThrottle
+from progress import ProgressBuffer
 from jinja2 import Environment
 
 app = Flask(__name__)
@@ -14,8 +16,16 @@ app.config['UPLOAD_FOLDER'] = app.config.get('UPLOAD_FOLDER', 'static/uploads')
 app.config['DEFAULT_COVER_IMAGE'] = app.config.get('DEFAULT_COVER_IMAGE', 'static/images/default_cover.jpg')
 ALLOWED_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 ALLOWED_BOOK_EXTENSIONS = {'pdf'}
+MAX_INT = 2 ** 31 - 1
 app.jinja_env.globals.update(str=str)
 db_connector = DBConnector(app)
+auth_throttle = AuthThrottle(app)
+progress_buffer = ProgressBuffer(db_connector)
+
+USERNAME_RE = re.compile(r'^[a-zA-Zа-яА-ЯёЁ]{2,20}$')
+LOGIN_RE = re.compile(r'^[a-zA-Zа-яА-ЯёЁ0-9_]{3,20}$')
+EMAIL_RE = re.compile(r'^[\w\.-]+@[\w\.-]+\.\w+$')
+PASSWORD_RE = re.compile(r'^[a-zA-Zа-яА-ЯёЁ0-9~!@#$%^&*_+()[\]{}<>\\/|"\'.,:;]{8,}$')
 
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -25,6 +35,16 @@ login_manager.login_message_category = 'warning'
 def allowed_file(filename, allowed_extensions):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
+# Тот же хеш, что давал SHA2(%s, 256) в MySQL: считаем его в приложении, а не на сервере БД
+def hash_password(password):
+    return hashlib.sha256(password.encode('utf-8')).hexdigest()
+
+def check_password(password_hash, password):
+    return hmac.compare_digest(password_hash or '', hash_password(password))
+
+# Хеш для несуществующего логина: время ответа не выдаёт, есть ли такой пользователь
+DUMMY_PASSWORD_HASH = hash_password('')
+
 def db_operation(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
@@ -163,6 +183,13 @@ def edit_user(cursor, user_id):
         print(f"Error in edit_user route: {e}")
         abort(500)
 
+#Статистика попыток входа
+@app.route('/admin/auth_stats')
+@login_required
+@admin_required
+def auth_stats():
+    return jsonify(auth_throttle.stats())
+
 #Начальная страница
 @app.route('/')
 def index():
@@ -181,8 +208,10 @@ def delete_user(cursor, user_id):
                 cursor.execute("DELETE FROM reviews WHERE user_id = %s", (user_id,))
                 cursor.execute("DELETE FROM wishes WHERE user_id = %s", (user_id,))
                 cursor.execute("DELETE FROM reservations WHERE user_id = %s", (user_id,))
+                cursor.execute("DELETE FROM reading_progress WHERE user_id = %s", (user_id,))
                 cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
                 connection.commit()
+            progress_buffer.forget_user(user_id)
             flash('Пользователь успешно удален!', 'success')
         except Exception as e:
             connection.rollback()
@@ -199,17 +228,21 @@ def auth(cursor):
             password = request.form['password']
             remember_me = request.form.get('remember_me', None) == 'on'
 
-            cursor.execute(
-                "SELECT id, login, role_id FROM users WHERE login = %s AND password_hash = SHA2(%s, 256)",
-                (login, password)
-            )
+            if not auth_throttle.allow(request.remote_addr, login, cursor):
+                flash('Слишком много попыток входа. Попробуйте позже', 'danger')
+                return render_template('auth.html'), 429
+
+            cursor.execute("SELECT id, login, role_id, password_hash FROM users WHERE login = %s", (login,))
             user = cursor.fetchone()
 
-            if user:
+            password_ok = check_password(user.password_hash if user else DUMMY_PASSWORD_HASH, password)
+            if user and password_ok:
+                auth_throttle.record('accepted')
                 flash('Авторизация прошла успешно', 'success')
                 login_user(User(user.id, user.login, user.role_id), remember=remember_me)
                 next_url = request.args.get('next', url_for('index'))
                 return redirect(next_url)
+            auth_throttle.failed(request.remote_addr, login, cursor)
             flash('Invalid username or password', 'danger')
         return render_template('auth.html')
     except Exception as e:
@@ -229,15 +262,19 @@ def register(cursor):
             confirm_password = request.form['confirm_password']
             role_id = request.form['role']
 
-            if not re.match(r'^[a-zA-Zа-яА-ЯёЁ]{2,20}$', username):
+            if not auth_throttle.allow(request.remote_addr, cursor=cursor):
+                flash('Слишком много попыток регистрации. Попробуйте позже', 'danger')
+                return render_template('register.html', username=username, login=login, email=email, role_id=role_id), 429
+
+            if not USERNAME_RE.match(username):
                 flash('Username должен содержать только буквы кириллицы и латиницы длиной от 2 до 20 символов', 'danger')
                 return render_template('register.html', username=username, login=login, email=email, role_id=role_id)
             
-            if not re.match(r'^[a-zA-Zа-яА-ЯёЁ0-9_]{3,20}$', login):
+            if not LOGIN_RE.match(login):
                 flash('Login должен содержать только буквы, цифры и символы "_" и быть длиной от 3 до 20 символов.', 'danger')
                 return render_template('register.html', username=username, login=login, email=email, role_id=role_id)
 
-            if not re.match(r'^[\w\.-]+@[\w\.-]+\.\w+$', email):
+            if not EMAIL_RE.match(email):
                 flash('Email некорректен.', 'danger')
                 return render_template('register.html', username=username, login=login, email=email, role_id=role_id)
 
@@ -245,18 +282,17 @@ def register(cursor):
                 flash('Пароли не совпадают', 'danger')
                 return render_template('register.html', username=username, login=login, email=email, role_id=role_id)
 
-            if not re.match(r'^[a-zA-Zа-яА-ЯёЁ0-9~!@#$%^&*_+()[\]{}<>\\/|"\'.,:;]{8,}$', password):
+            if not PASSWORD_RE.match(password):
                 flash('Пароль должен быть минимум 8 символов длиной и содержать буквы, цифры и специальные символы.', 'danger')
                 return render_template('register.html', username=username, login=login, email=email, role_id=role_id)
 
             cursor.execute(
                 "INSERT INTO users (username, login, password_hash, email, role_id) "
-                "VALUES (%s, %s, SHA2(%s, 256), %s, %s)",
-                (username, login, password, email, role_id)
+                "VALUES (%s, %s, %s, %s, %s)",
+                (username, login, hash_password(password), email, role_id)
             )
-            cursor.execute("SELECT id FROM users WHERE login = %s", (login,))
-            user = cursor.fetchone()
-            login_user(User(user.id, login, role_id))
+            auth_throttle.record('registered')
+            login_user(User(cursor.lastrowid, login, role_id))
             flash('Регистрация прошла успешно!', 'success')
             return redirect(url_for('books'))
         return render_template('register.html')
@@ -299,7 +335,27 @@ def profile(cursor):
     """, (current_user.id,))
     reading_books = cursor.fetchall()
 
-    return render_template('profile.html', user=user, reserved_books=reserved_books, reading_books=reading_books)
+    cursor.execute("""
+        SELECT books.id AS book_id, books.title, reading_progress.page, reading_progress.updated_at
+        FROM reading_progress
+        JOIN books ON reading_progress.book_id = books.id
+        WHERE reading_progress.user_id = %s
+    """, (current_user.id,))
+    progress = {row.book_id: row._asdict() for row in cursor.fetchall()}
+    # Ещё не сброшенные в БД отчёты свежее сохранённых
+    pending = progress_buffer.pending_for_user(current_user.id)
+    missing = [book_id for book_id in pending if book_id not in progress]
+    if missing:
+        cursor.execute("SELECT id AS book_id, title FROM books WHERE id IN (%s)" % ', '.join(['%s'] * len(missing)), missing)
+        for row in cursor.fetchall():
+            progress[row.book_id] = row._asdict()
+    for book_id, (page, scroll_offset, updated_at) in pending.items():
+        if book_id in progress:
+            progress[book_id].update(page=page, updated_at=updated_at)
+    reading_progress = sorted(progress.values(), key=lambda row: row['updated_at'], reverse=True)
+
+    return render_template('profile.html', user=user, reserved_books=reserved_books, reading_books=reading_books,
+                           reading_progress=reading_progress)
 
 #Редактирование профиля
 @app.route('/edit_profile', methods=['GET', 'POST'])
@@ -471,11 +527,52 @@ def read_book(cursor, book_id):
         if not os.path.exists(book_file_path):
             abort(404)
 
-        return render_template('read_book.html', book_file=book_file)
+        progress_buffer.remember_book(book_id)
+        progress = progress_buffer.get(current_user.id, book_id)
+        if progress is None:
+            cursor.execute("""
+                SELECT page, scroll_offset, updated_at
+                FROM reading_progress
+                WHERE user_id = %s AND book_id = %s
+            """, (current_user.id, book_id))
+            progress = cursor.fetchone()
+        page, scroll_offset = (progress[0], progress[1]) if progress else (1, 0)
+
+        return render_template('read_book.html', book_file=book_file, book_id=book_id, page=page, scroll_offset=scroll_offset,
+                               progress_interval=app.config.get('PROGRESS_REPORT_INTERVAL', 5))
     except Exception as e:
         print(f"Error in read_book route: {e}")
         abort(500)
 
+#Прогресс чтения (пишется в буфер, в БД попадает пакетами)
+@app.route('/read_book/<int:book_id>/progress', methods=['POST'])
+@login_required
+def read_progress(book_id):
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        abort(400)
+    page = data.get('page', 1)
+    scroll_offset = data.get('scroll_offset', 0)
+    if isinstance(page, bool) or isinstance(scroll_offset, bool):
+        abort(400)
+    try:
+        page = int(page)
+        scroll_offset = int(scroll_offset)
+    except (TypeError, ValueError):
+        abort(400)
+    if not 1 <= page <= MAX_INT or not 0 <= scroll_offset <= MAX_INT:
+        abort(400)
+    # Проверка книги кешируется: в буфер не попадают строки, которые сорвут пакетную запись
+    if not progress_buffer.knows_book(book_id):
+        with db_connector.connect().cursor(named_tuple=True) as cursor:
+            cursor.execute("SELECT id FROM books WHERE id = %s", (book_id,))
+            if cursor.fetchone() is None:
+                abort(404)
+        progress_buffer.remember_book(book_id)
+    if not progress_buffer.update(current_user.id, book_id, page, scroll_offset):
+        abort(429)
+    return '', 204
+
 #Редактировать книгу
 @app.route('/admin/edit_book/<int:book_id>', methods=['GET', 'POST'])
 @login_required
@@ -596,8 +693,10 @@ def delete_book(cursor, book_id):
         try:
             cursor.execute("DELETE FROM reviews WHERE book_id = %s", (book_id,))
             cursor.execute("DELETE FROM reservations WHERE book_id = %s", (book_id,))
+            cursor.execute("DELETE FROM reading_progress WHERE book_id = %s", (book_id,))
             cursor.execute("DELETE FROM books WHERE id = %s", (book_id,))
             cursor.connection.commit()  # Используем явное соединение для commit
+            progress_buffer.forget_book(book_id)
             flash('Книга успешно удалена!', 'success')
         except Exception as e:
             flash(f'Ошибка при удалении книги: {str(e)}', 'danger')
@@ -9,3 +9,24 @@ MYSQL_HOST = 'std-mysql.ist.mospolytech.ru'
 
 UPLOAD_FOLDER = 'static/uploads'
 DEFAULT_COVER_IMAGE = 'static/images/default_cover.jpg'
+
+# Ограничение попыток входа и регистрации (token bucket)
+AUTH_IP_CAPACITY = 20
+AUTH_IP_REFILL_PER_SEC = 0.2
+AUTH_LOGIN_CAPACITY = 5
+AUTH_LOGIN_REFILL_PER_SEC = 1 / 60
+# Общий лимит неудачных попыток на логин со всех IP
+AUTH_LOGIN_GLOBAL_CAPACITY = 50
+AUTH_LOGIN_GLOBAL_REFILL_PER_SEC = 0.1
+# True - дополнительно хранить корзины в таблице auth_buckets, общей для всех воркеров
+AUTH_THROTTLE_SHARED = False
+
+# Прогресс чтения: как часто читатель присылает позицию и как часто буфер сбрасывается в БД (сек.)
+PROGRESS_REPORT_INTERVAL = 5
+PROGRESS_FLUSH_INTERVAL = 10
+# pdf.js для читалки; PDFJS_INTEGRITY - SRI-хеш pdf.min.js (sha384-... / sha512-...) для атрибута integrity
+PDFJS_URL = 'https://cdnjs.cloudflare.com/ajax/libs/pdf.js/3.11.174/pdf.min.js'
+PDFJS_WORKER_URL = 'https://cdnjs.cloudflare.com/ajax/libs/pdf.js/3.11.174/pdf.worker.min.js'
+PDFJS_INTEGRITY = ''
+# Сколько книг одного пользователя может ждать сброса в буфере
+PROGRESS_MAX_BOOKS_PER_USER = 20
@@ -0,0 +1,130 @@
+import atexit, datetime, threading
+import mysql.connector
+
+UPSERT_PROGRESS = """
+    INSERT INTO reading_progress (user_id, book_id, page, scroll_offset, updated_at)
+    VALUES (%s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE page = VALUES(page), scroll_offset = VALUES(scroll_offset), updated_at = VALUES(updated_at)
+"""
+
+class ProgressBuffer:
+    def __init__(self, db_connector):
+        self.db_connector = db_connector
+        self.interval = db_connector.app.config.get('PROGRESS_FLUSH_INTERVAL', 10)
+        self.max_per_user = db_connector.app.config.get('PROGRESS_MAX_BOOKS_PER_USER', 20)
+        self.pending = {}
+        self.per_user = {}
+        self.known_books = set()
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.thread = None
+        atexit.register(self.shutdown)
+
+    def update(self, user_id, book_id, page, scroll_offset):
+        # Повторные отчёты об одной книге схлопываются в одну запись до следующего сброса
+        with self.lock:
+            key = (user_id, book_id)
+            if key not in self.pending:
+                if self.per_user.get(user_id, 0) >= self.max_per_user:
+                    return False
+                self.per_user[user_id] = self.per_user.get(user_id, 0) + 1
+            self.pending[key] = (page, scroll_offset, datetime.datetime.now())
+        self.start()
+        return True
+
+    def get(self, user_id, book_id):
+        with self.lock:
+            return self.pending.get((user_id, book_id))
+
+    def pending_for_user(self, user_id):
+        with self.lock:
+            return {book_id: value for (uid, book_id), value in self.pending.items() if uid == user_id}
+
+    def knows_book(self, book_id):
+        return book_id in self.known_books
+
+    def remember_book(self, book_id):
+        self.known_books.add(book_id)
+
+    def forget_book(self, book_id):
+        self.known_books.discard(book_id)
+        with self.lock:
+            for key in [key for key in self.pending if key[1] == book_id]:
+                self.pop_pending(key)
+
+    def forget_user(self, user_id):
+        with self.lock:
+            for key in [key for key in self.pending if key[0] == user_id]:
+                self.pop_pending(key)
+
+    def pop_pending(self, key):
+        del self.pending[key]
+        self.per_user[key[0]] -= 1
+        if not self.per_user[key[0]]:
+            del self.per_user[key[0]]
+
+    def start(self):
+        # Поток запускается лениво, в том процессе, который реально обслуживает запросы
+        if self.thread is None or not self.thread.is_alive():
+            with self.lock:
+                if self.thread is None or not self.thread.is_alive():
+                    self.thread = threading.Thread(target=self.run, daemon=True)
+                    self.thread.start()
+
+    def run(self):
+        while not self.stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error in progress flush: {e}")
+
+    def shutdown(self):
+        self.stop.set()
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Error in progress flush: {e}")
+
+    def flush(self):
+        with self.lock:
+            batch, self.pending, self.per_user = self.pending, {}, {}
+        if not batch:
+            return 0
+        rows = [(user_id, book_id, page, scroll_offset, updated_at)
+                for (user_id, book_id), (page, scroll_offset, updated_at) in batch.items()]
+        connection = None
+        try:
+            connection = mysql.connector.connect(**self.db_connector.get_config())
+            with connection.cursor() as cursor:
+                try:
+                    cursor.executemany(UPSERT_PROGRESS, rows)
+                except mysql.connector.OperationalError:
+                    raise
+                except mysql.connector.DatabaseError:
+                    # Ошибочная строка не должна блокировать весь пакет: пишем по одной и отбрасываем сбойные
+                    connection.rollback()
+                    for row in rows:
+                        try:
+                            cursor.execute(UPSERT_PROGRESS, row)
+                        except mysql.connector.OperationalError:
+                            raise
+                        except mysql.connector.DatabaseError as e:
+                            print(f"Skipping progress {row[:2]}: {e}")
+            connection.commit()
+        except Exception:
+            if connection is not None:
+                try:
+                    connection.rollback()
+                except mysql.connector.Error:
+                    pass
+            # Не теряем обновления: возвращаем в буфер всё, что не перезаписано более свежими
+            with self.lock:
+                for key, value in batch.items():
+                    if key not in self.pending:
+                        self.pending[key] = value
+                        self.per_user[key[0]] = self.per_user.get(key[0], 0) + 1
+            raise
+        finally:
+            if connection is not None:
+                connection.close()
+        return len(rows)
@@ -0,0 +1,132 @@
+import threading, time
+from collections import OrderedDict
+
+class TokenBucket:
+    def __init__(self, capacity, refill_rate, max_keys=10000):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.max_keys = max_keys
+        # LRU: давно не использованные ключи вытесняются за O(1), словарь не растёт бесконечно
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def consume(self, key, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.refill_rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+            return allowed
+
+    def peek(self, key, now=None):
+        # Проверка без списания токена
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (self.capacity, now))
+            return min(self.capacity, tokens + (now - updated) * self.refill_rate) >= 1
+
+class SharedTokenBucket:
+    # Общее состояние для нескольких воркеров в MEMORY-таблице auth_buckets
+    def __init__(self, name, capacity, refill_rate, cleanup_interval=60):
+        self.name = name
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.cleanup_interval = cleanup_interval
+        self.last_cleanup = 0
+        self.lock = threading.Lock()
+
+    def consume(self, cursor, key, now=None):
+        now = time.time() if now is None else now
+        self.cleanup(cursor, now)
+        bucket_key = f"{self.name}:{key}"[:255]
+        # Как и в TokenBucket, отклонённая попытка токен не списывает.
+        # Вердикт возвращается атомарно через LAST_INSERT_ID(): 1 - разрешено, 2 - отказ,
+        # 0 - строка только что вставлена (полная корзина, разрешено).
+        refilled = "LEAST(%s, tokens + (VALUES(updated_at) - updated_at) * %s)"
+        cursor.execute(f"""
+            INSERT INTO auth_buckets (bucket_key, tokens, updated_at)
+            VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                tokens = IF(LAST_INSERT_ID(IF({refilled} >= 1, 1, 2)) = 1, {refilled} - 1, {refilled}),
+                updated_at = VALUES(updated_at)
+        """, (bucket_key, self.capacity - 1, now) + (self.capacity, self.refill_rate) * 3)
+        return cursor.lastrowid != 2
+
+    def peek(self, cursor, key, now=None):
+        now = time.time() if now is None else now
+        cursor.execute("""
+            SELECT LEAST(%s, tokens + (%s - updated_at) * %s) >= 1 AS allowed
+            FROM auth_buckets WHERE bucket_key = %s
+        """, (self.capacity, now, self.refill_rate, f"{self.name}:{key}"[:255]))
+        row = cursor.fetchone()
+        return row is None or bool(row[0])
+
+    def cleanup(self, cursor, now):
+        # Корзина, простоявшая capacity / refill_rate секунд, уже полна - её строку можно удалить
+        with self.lock:
+            if now - self.last_cleanup < self.cleanup_interval:
+                return
+            self.last_cleanup = now
+        cursor.execute("DELETE FROM auth_buckets WHERE bucket_key LIKE %s AND updated_at < %s",
+                       (f"{self.name}:%", now - self.capacity / self.refill_rate))
+
+class AuthThrottle:
+    def __init__(self, app):
+        self.app = app
+        ip_capacity = app.config.get('AUTH_IP_CAPACITY', 20)
+        ip_rate = app.config.get('AUTH_IP_REFILL_PER_SEC', 0.2)
+        login_capacity = app.config.get('AUTH_LOGIN_CAPACITY', 5)
+        login_rate = app.config.get('AUTH_LOGIN_REFILL_PER_SEC', 1 / 60)
+        global_capacity = app.config.get('AUTH_LOGIN_GLOBAL_CAPACITY', 50)
+        global_rate = app.config.get('AUTH_LOGIN_GLOBAL_REFILL_PER_SEC', 0.1)
+        self.by_ip = TokenBucket(ip_capacity, ip_rate)
+        # Неудачи считаются по паре (IP, логин) и, с более мягким лимитом, по логину целиком
+        self.by_login = TokenBucket(login_capacity, login_rate)
+        self.by_login_global = TokenBucket(global_capacity, global_rate)
+        self.shared = app.config.get('AUTH_THROTTLE_SHARED', False)
+        if self.shared:
+            self.shared_by_ip = SharedTokenBucket('ip', ip_capacity, ip_rate)
+            self.shared_by_login = SharedTokenBucket('login', login_capacity, login_rate)
+            self.shared_by_login_global = SharedTokenBucket('login_global', global_capacity, global_rate)
+        self.counters = {'accepted': 0, 'failed': 0, 'rejected': 0, 'registered': 0}
+        self.counters_lock = threading.Lock()
+
+    def allow(self, ip, login=None, cursor=None):
+        # Сначала локальные корзины: отказ без единого обращения к БД.
+        # Корзины логина только проверяются - токен списывается лишь за неверный пароль,
+        # иначе чужими запросами можно было бы заблокировать вход конкретному пользователю
+        allowed = self.by_ip.consume(ip) and (login is None or self.login_allowed(ip, login.lower()))
+        if allowed and self.shared and cursor is not None:
+            allowed = self.shared_by_ip.consume(cursor, ip) and \
+                (login is None or self.shared_login_allowed(cursor, ip, login.lower()))
+        if not allowed:
+            self.record('rejected')
+        return allowed
+
+    def login_allowed(self, ip, login):
+        return self.by_login.peek(f"{ip}|{login}") and self.by_login_global.peek(login)
+
+    def shared_login_allowed(self, cursor, ip, login):
+        return self.shared_by_login.peek(cursor, f"{ip}|{login}") and self.shared_by_login_global.peek(cursor, login)
+
+    def failed(self, ip, login, cursor=None):
+        self.record('failed')
+        login = login.lower()
+        self.by_login.consume(f"{ip}|{login}")
+        self.by_login_global.consume(login)
+        if self.shared and cursor is not None:
+            self.shared_by_login.consume(cursor, f"{ip}|{login}")
+            self.shared_by_login_global.consume(cursor, login)
+
+    def record(self, outcome):
+        with self.counters_lock:
+            self.counters[outcome] += 1
+
+    def stats(self):
+        with self.counters_lock:
+            return dict(self.counters)